@@ -1,9 +1,24 @@
 from fastapi import FastAPI, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from functools import lru_cache
+import asyncio
+import hashlib
+import multiprocessing
 import pdfplumber
+import pypdfium2 as pdfium
+import numpy as np
 import pandas as pd
 import io
+import math
+import os
 import re
+import threading
+import xlsxwriter
 
 app = FastAPI()
 
@@ -18,15 +33,44 @@ def clean_number(value):
     """
     if value is None:
         return None
+    # Already-numeric cells (e.g. re-cleaned values) skip the string parsing
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if isinstance(value, float):
+            if math.isnan(value):
+                return None
+            return int(value) if value.is_integer() else value
+        return value
+    if isinstance(value, str):
+        return _clean_number_str(value)
     try:
         if pd.isna(value):
             return None
     except (TypeError, ValueError):
         pass
 
-    s = str(value).replace('$', '').strip()
+    result = _clean_number_str(str(value))
+    # Unparseable → keep the original object, not its string form
+    return value if isinstance(result, str) else result
+
+
+# Deletes ASCII digits; a string that translates to '' is a plain integer
+_PLAIN_DIGITS = str.maketrans('', '', '0123456789')
+
+
+@lru_cache(maxsize=4096)
+def _clean_number_str(value):
+    """String branch of clean_number, memoized.
+
+    Statements repeat the same amount strings ('$ 0.00', '0', '-') across many
+    rows, so most calls are cache hits; see _clean_number_str.cache_info().
+    Returns the input string unchanged when it can't be parsed.
+    """
+    s = value.replace('$', '').strip()
     if not s or s == '-':
         return None
+    # Plain ASCII integer (most IBC/aporte cells): nothing left to disambiguate
+    if not s.translate(_PLAIN_DIGITS):
+        return int(s)
 
     last_dot = s.rfind('.')
     last_comma = s.rfind(',')
@@ -59,97 +103,363 @@ def clean_number(value):
         return value
 
 
+# Anything besides digits, separators and a minus sign (letters, inner blanks,
+# parentheses...) — such cells take the scalar clean_number path
+_RE_CURRENCY = re.compile(r'[^\d,.\-]')
+
+
+def clean_number_series(series):
+    """Vectorized clean_number for a whole DataFrame column.
+
+    Applies the same "last separator wins" rules with pandas string ops instead
+    of one Python call per cell. Outliers (see _RE_CURRENCY) and cells that
+    still don't parse go through clean_number, so the result matches the
+    scalar version; empty cells become NaN.
+    """
+    s = series.astype('string').str.replace('$', '', regex=False).str.strip()
+    s = s.mask(s.isin(['', '-']))
+    outlier = s.str.contains(_RE_CURRENCY, na=False)
+
+    last_dot = s.str.rfind('.')
+    last_comma = s.str.rfind(',')
+    dot_last = (last_dot > last_comma).fillna(False)
+    many_dots = (s.str.count(r'\.') > 1).fillna(False)
+    comma_decimal = ((last_comma > last_dot) & s.str.contains(r',\d{2}$')).fillna(False)
+
+    # Default: commas are thousands separators. Multiple dots → all thousands.
+    # Last comma + 2 trailing digits → comma is the decimal separator.
+    no_commas = s.str.replace(',', '', regex=False)
+    cleaned = np.where(
+        dot_last & many_dots,
+        no_commas.str.replace('.', '', regex=False),
+        np.where(
+            comma_decimal,
+            s.str.replace('.', '', regex=False).str.replace(',', '.', regex=False),
+            no_commas,
+        ),
+    )
+
+    nums = pd.to_numeric(pd.Series(cleaned, index=series.index, name=series.name), errors='coerce')
+    fallback = (outlier | nums.isna()) & s.notna()
+    if fallback.any():
+        nums = nums.astype(object)
+        nums[fallback] = series[fallback].map(clean_number)
+    return nums
+
+
+# ─────────────────────────────────────────────
+# PDF ACCESS / PAGE-PARALLEL PARSING
+# ─────────────────────────────────────────────
+
+# Below this many pages a worker's start-up and its own parse of the PDF
+# structure cost more than laying the pages out in-process
+_PARALLEL_MIN_PAGES = 4
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+# PDFium is not thread-safe and the request threadpool runs uploads side by
+# side, so every PdfDocument lives and dies under this lock (_open_pdfium)
+_PDFIUM_LOCK = threading.Lock()
+
+
+def _process_pool():
+    """Process pool for page ranges and whole short documents, created on first use.
+
+    Uses 'spawn' rather than fork: the server process has live threads
+    (uvicorn, the request threadpool) that fork would copy mid-state.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+    return _POOL
+
+
+def _discard_pool(pool):
+    """Drop a broken pool (a worker died) so _process_pool() builds a fresh one.
+
+    Only clears _POOL if it is still this pool: a concurrent request may
+    already have replaced it.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is pool:
+            _POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _open_pdf(pdf_stream):
+    """pdfplumber.open for a file-like object or the raw PDF bytes.
+
+    The extractors accept either, so the endpoints read an upload once and
+    pass the same bytes everywhere. BytesIO shares the bytes' buffer until
+    written to, so wrapping them copies nothing.
+    """
+    if isinstance(pdf_stream, (bytes, bytearray)):
+        pdf_stream = io.BytesIO(pdf_stream)
+    return pdfplumber.open(pdf_stream)
+
+
+def _read_pdf_bytes(pdf_stream):
+    """Whole content of pdf_stream (bytes are returned as is).
+
+    A stream's position is left where it was; pdfminer may still be reading
+    it sequentially.
+    """
+    if isinstance(pdf_stream, (bytes, bytearray)):
+        return pdf_stream
+    pos = pdf_stream.tell()
+    pdf_stream.seek(0)
+    data = pdf_stream.read()
+    pdf_stream.seek(pos)
+    return data
+
+
+class _ReadIntoStream:
+    """seek/tell/read/readinto view of a stream that lacks readinto.
+
+    pypdfium2 only accepts streams with all four; SpooledTemporaryFile (what
+    UploadFile wraps) has no readinto before Python 3.11.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.seek = stream.seek
+        self.tell = stream.tell
+        self.read = stream.read
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        memoryview(buffer).cast('B')[:len(data)] = data
+        return len(data)
+
+
+@contextmanager
+def _open_pdfium(pdf_stream):
+    """PDFium document over the raw bytes or a stream, without copying it.
+
+    A stream is read in place through PDFium's file callbacks; its position
+    is restored on close, since pdfminer may be reading the same stream.
+    _PDFIUM_LOCK is held from opening to close, so the document and its
+    pages must not escape the with block.
+    """
+    if isinstance(pdf_stream, bytearray):
+        pdf_stream = bytes(pdf_stream)  # pypdfium2 takes bytes, not bytearray
+    pos = None if isinstance(pdf_stream, bytes) else pdf_stream.tell()
+    source = pdf_stream
+    if pos is not None and not hasattr(pdf_stream, 'readinto'):
+        source = _ReadIntoStream(pdf_stream)
+    with _PDFIUM_LOCK:
+        doc = pdfium.PdfDocument(source)
+        try:
+            yield doc
+        finally:
+            doc.close()
+            if pos is not None:
+                pdf_stream.seek(pos)
+
+
+def _page_count(pdf_stream):
+    """Number of pages, read with PDFium (no layout work)."""
+    with _open_pdfium(pdf_stream) as doc:
+        return len(doc)
+
+
+def _upload_digest(pdf_stream):
+    """blake2b digest of a stream, read in 1 MB blocks; leaves it at 0."""
+    digest = hashlib.blake2b()
+    pdf_stream.seek(0)
+    for block in iter(lambda: pdf_stream.read(1 << 20), b''):
+        digest.update(block)
+    pdf_stream.seek(0)
+    return digest.digest()
+
+
+def _parse_page_range(page_func, pdf_bytes, start, stop):
+    """Worker: run page_func on pages[start:stop] of the PDF in pdf_bytes."""
+    out = []
+    with _open_pdf(pdf_bytes) as pdf:
+        for page in pdf.pages[start:stop]:
+            out.extend(page_func(page))
+    return out
+
+
+def _map_pages(page_func, pdf, pdf_stream):
+    """Concatenate page_func(page) over every page of an open pdfplumber PDF.
+
+    Documents with at least _PARALLEL_MIN_PAGES pages are split into one
+    contiguous page range per worker process, each re-opening the PDF from
+    its bytes; results keep page order. page_func must be a module-level
+    function so it can be pickled.
+    """
+    npages = len(pdf.pages)
+    workers = min(os.cpu_count() or 1, npages)
+    if npages < _PARALLEL_MIN_PAGES or workers < 2:
+        out = []
+        for page in pdf.pages:
+            out.extend(page_func(page))
+        return out
+
+    pdf_bytes = _read_pdf_bytes(pdf_stream)
+    step = -(-npages // workers)  # ceil
+    ranges = [(start, min(start + step, npages)) for start in range(0, npages, step)]
+    try:
+        return _map_ranges(_process_pool(), page_func, pdf_bytes, ranges)
+    except BrokenProcessPool:
+        # A worker died (OOM, crash on a bad PDF): retry once on a new pool
+        return _map_ranges(_process_pool(), page_func, pdf_bytes, ranges)
+
+
+def _map_ranges(pool, page_func, pdf_bytes, ranges):
+    """Submit each (start, stop) page range to pool; results in range order.
+
+    A broken pool is discarded before BrokenProcessPool propagates.
+    """
+    try:
+        futures = [pool.submit(_parse_page_range, page_func, pdf_bytes, start, stop)
+                   for start, stop in ranges]
+        out = []
+        for future in futures:
+            out.extend(future.result())
+        return out
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+
+
 # ─────────────────────────────────────────────
 # INVOICE EXTRACTOR
 # ─────────────────────────────────────────────
 
-def extract_data_from_pdf(pdf_stream):
+# DIAN header fields — one alternation so the text is scanned a single time.
+# Group names: v_* = vendedor (emisor), c_* = comprador (adquiriente).
+_HEADER_RE = re.compile(
+    r"(?:Razón Social: (?P<v_rs>.*?)\n)"
+    r"|(?:Nit del Emisor: (?P<v_nit>.*?)\n)"
+    r"|(?:Datos del Adquiriente / Comprador\nNombre o Razón Social: (?P<c_rs>.*?)\n)"
+    r"|(?:Número Documento: (?P<c_nit>.*?)\n)"
+)
+
+
+# Items table columns (page 0, first table) and the ones cleaned with clean_number_series
+_INVOICE_HEADERS = [
+    "Nro", "Código", "Descripción", "U/M", "Cantidad",
+    "Precio unitario", "Descuento", "Recargo",
+    "IVA", "IVA %", "INC", "INC %", "Total Item"
+]
+_INVOICE_NUMERIC = {
+    "Nro", "Cantidad", "Precio unitario", "Descuento",
+    "Recargo", "IVA", "IVA %", "INC", "INC %", "Total Item"
+}
+
+
+def _parse_invoice_header(full_text):
+    """Return (vendedor, comprador) dicts from the invoice text.
+
+    Keeps the first occurrence of each field and stops scanning once all four
+    are found. A party is only filled in when both its Razón Social and NIT exist.
+    """
+    fields = {}
+    for m in _HEADER_RE.finditer(full_text):
+        fields.setdefault(m.lastgroup, m.group(m.lastgroup))
+        if len(fields) == 4:
+            break
+
     vendedor = {}
     comprador = {}
-    items = []
+    if 'v_rs' in fields and 'v_nit' in fields:
+        vendedor = {"Razón Social": fields['v_rs'].strip(), "NIT": fields['v_nit'].strip()}
+    if 'c_rs' in fields and 'c_nit' in fields:
+        comprador = {"Razón Social": fields['c_rs'].strip(), "NIT": fields['c_nit'].strip()}
+    return vendedor, comprador
 
-    numeric_columns = {
-        "Nro", "Cantidad", "Precio unitario", "Descuento",
-        "Recargo", "IVA", "IVA %", "INC", "INC %", "Total Item"
-    }
 
-    with pdfplumber.open(pdf_stream) as pdf:
+def extract_data_from_pdf(pdf_stream):
+    columns = []
+
+    with _open_pdf(pdf_stream) as pdf:
+        # Header fields live on the first page(s); stop extracting text as soon
+        # as both parties are found instead of laying out every page. Items are
+        # taken in the same pass while page 1 is loaded.
         full_text = ""
+        vendedor, comprador = {}, {}
         for page in pdf.pages:
+            if page.page_number == 1:
+                # Items — first table, data starts at row index 2
+                tables = page.extract_tables()
+                if tables:
+                    # Rows cut/padded to the header width, transposed once into
+                    # one tuple per column
+                    width = len(_INVOICE_HEADERS)
+                    columns = list(zip(*(
+                        tuple(row[:width]) + (None,) * (width - len(row))
+                        for row in tables[0][2:]
+                    )))
+
             text = page.extract_text()
             if text:
                 full_text += text + "\n"
-
-        # Extract Vendedor
-        vendedor_razon_social = re.search(r"Razón Social: (.*?)\n", full_text)
-        vendedor_nit = re.search(r"Nit del Emisor: (.*?)\n", full_text)
-        if vendedor_razon_social and vendedor_nit:
-            vendedor = {
-                "Razón Social": vendedor_razon_social.group(1).strip(),
-                "NIT": vendedor_nit.group(1).strip(),
-            }
-
-        # Extract Comprador
-        comprador_razon_social = re.search(
-            r"Datos del Adquiriente / Comprador\nNombre o Razón Social: (.*?)\n", full_text
-        )
-        comprador_nit = re.search(r"Número Documento: (.*?)\n", full_text)
-        if comprador_razon_social and comprador_nit:
-            comprador = {
-                "Razón Social": comprador_razon_social.group(1).strip(),
-                "NIT": comprador_nit.group(1).strip(),
-            }
-
-        # Extract Items — page 0, first table, data starts at row index 2
-        page = pdf.pages[0]
-        tables = page.extract_tables()
-        if tables:
-            item_table = tables[0]
-            headers = [
-                "Nro", "Código", "Descripción", "U/M", "Cantidad",
-                "Precio unitario", "Descuento", "Recargo",
-                "IVA", "IVA %", "INC", "INC %", "Total Item"
-            ]
-            for row in item_table[2:]:
-                item_data = {}
-                for i, header in enumerate(headers):
-                    val = row[i] if i < len(row) else None
-                    if header in numeric_columns:
-                        val = clean_number(val)
-                    item_data[header] = val
-                items.append(item_data)
-
-    df_info = pd.DataFrame({
-        'Tipo': ['Vendedor', 'Comprador'],
-        'Razón Social': [vendedor.get('Razón Social'), comprador.get('Razón Social')],
-        'NIT': [vendedor.get('NIT'), comprador.get('NIT')]
-    })
-    df_items = pd.DataFrame(items)
-    return {"Info": df_info, "Items": df_items}
+                vendedor, comprador = _parse_invoice_header(full_text)
+                if vendedor and comprador:
+                    break
+
+    # Info is three fixed rows (header first) written straight to the sheet
+    info_rows = [
+        ['Tipo', 'Razón Social', 'NIT'],
+        ['Vendedor', vendedor.get('Razón Social'), vendedor.get('NIT')],
+        ['Comprador', comprador.get('Razón Social'), comprador.get('NIT')],
+    ]
+    if columns:
+        df_items = pd.DataFrame({
+            h: clean_number_series(pd.Series(col)) if h in _INVOICE_NUMERIC else list(col)
+            for h, col in zip(_INVOICE_HEADERS, columns)
+        })
+    else:
+        df_items = pd.DataFrame()
+    return {"Info": info_rows, "Items": df_items}
 
 
 # ─────────────────────────────────────────────
 # BANK STATEMENT EXTRACTOR
 # ─────────────────────────────────────────────
 
+# The per-bank line patterns are MULTILINE and scanned with finditer
+# over the whole text; [^\S\n] is "whitespace except newline" so a match never
+# spans two lines.
+#
+# Backtracking is bounded: the only lazy part is the description, amounts need
+# a literal '.', and no quantifier is nested inside another. The description
+# starts and ends on a non-blank, or is a single blank directly followed by
+# one more blank and a word (what a bare `.+?` matched when only blanks sat
+# between the two columns). Neither separator around it can then hand a run
+# of blanks back to be re-scanned from every offset, so a long run of spaces
+# anywhere on a failing line costs linear time. Keep new patterns in that
+# shape (no `(\s+\w+)+`-style nesting, no blank-led lazy groups).
+
 # ── Bancolombia ──────────────────────────────────────────────────────────────
 # Lines: "1/04 PAGO QR ERIS DAYID B. 24,300.00 3,888,729.61"
 #        "1/04 ABONO INTERESES AHORROS .86 4,751,911.77"
 _BANCOLOMBIA_PATTERN = re.compile(
-    r'^(\d{1,2}/\d{2})\s+'      # FECHA  e.g. 1/04, 15/06
-    r'(.+?)\s+'                  # DESCRIPCIÓN  (non-greedy)
-    r'(-?[\d,]*\.[\d]+)\s+'     # VALOR  (possibly negative, possibly ".86")
-    r'(-?[\d,]*\.[\d]+)\s*$'    # SALDO
+    r'^[^\S\n]*(\d{1,2}/\d{2})[^\S\n]+'             # FECHA  e.g. 1/04, 15/06
+    r'(\S(?:.*?\S)?|[^\S\n](?=[^\S\n]\S))[^\S\n]+'  # DESCRIPCIÓN  (non-greedy)
+    r'(-?[\d,]*\.[\d]+)[^\S\n]+'                    # VALOR  (possibly negative, possibly ".86")
+    r'(-?[\d,]*\.[\d]+)[^\S\n]*$',                  # SALDO
+    re.MULTILINE,
 )
 
 # ── Davivienda ───────────────────────────────────────────────────────────────
 # Lines: "01 01 9070 Abono ventas netas Mastercard 17015595 $ 0.00 $ 5,534,339.00"
 #        "02 01 0033 Pago ENEL PAGO FACTURA ... $ 1,452,470.00 $ 0.00"
 _DAVIVIENDA_PATTERN = re.compile(
-    r'^(\d{2})\s+(\d{2})\s+\d+\s+'        # DIA MES OFICINA
-    r'(.+?)\s+'                             # DESCRIPCIÓN (non-greedy)
-    r'\$\s*([\d,]+\.[\d]{2})\s+'           # DÉBITO
-    r'\$\s*([\d,]+\.[\d]{2})\s*$'          # CRÉDITO
+    r'^[^\S\n]*(\d{2})[^\S\n]+(\d{2})[^\S\n]+\d+[^\S\n]+'  # DIA MES OFICINA
+    r'(\S(?:.*?\S)?|[^\S\n](?=[^\S\n]\S))[^\S\n]+'         # DESCRIPCIÓN (non-greedy)
+    r'\$[^\S\n]*([\d,]+\.[\d]{2})[^\S\n]+'                 # DÉBITO
+    r'\$[^\S\n]*([\d,]+\.[\d]{2})[^\S\n]*$',               # CRÉDITO
+    re.MULTILINE,
 )
 
 # Lines that are headers/footers in Davivienda — never continuations
@@ -161,15 +471,28 @@ _DAVI_SKIP = re.compile(
     re.IGNORECASE,
 )
 
+# ── Davivienda or Bancolombia, one pass ─────────────────────────────────────
+# Used when the header names no bank. The two line formats are disjoint (only
+# Bancolombia has D/MM, only Davivienda has the '$' columns), so one scan of
+# the alternation finds exactly the lines the two patterns find separately.
+# lastgroup is the outer name; each format's own groups are sliced from groups().
+_DAVI_OR_BANCO = re.compile(
+    f'(?P<davi>{_DAVIVIENDA_PATTERN.pattern})|(?P<banco>{_BANCOLOMBIA_PATTERN.pattern})',
+    re.MULTILINE,
+)
+_DAVI_GROUPS = slice(1, 1 + _DAVIVIENDA_PATTERN.groups)
+_BANCO_GROUPS = slice(_DAVI_GROUPS.stop + 1, _DAVI_GROUPS.stop + 1 + _BANCOLOMBIA_PATTERN.groups)
+
 # ── BBVA ─────────────────────────────────────────────────────────────────────
 # Lines: "23204 02-02-2026 31-01-2026 DEP. ELECTRONICO COMERCIO 0016870008 2,545,068.95 61,659,540.48"
 _BBVA_PATTERN = re.compile(
-    r'^\d{5}\s+'                   # SEQ# (5 digits)
-    r'(\d{2}-\d{2}-\d{4})\s+'     # Fecha operación
-    r'\d{2}-\d{2}-\d{4}\s+'       # Fecha valor (ignored)
-    r'(.+?)\s+'                    # Descripción (non-greedy)
-    r'([\d,]+\.\d{2})\s+'         # Monto (always positive)
-    r'([\d,]+\.\d{2})\s*$'        # Saldo
+    r'^[^\S\n]*\d{5}[^\S\n]+'                       # SEQ# (5 digits)
+    r'(\d{2}-\d{2}-\d{4})[^\S\n]+'                  # Fecha operación
+    r'\d{2}-\d{2}-\d{4}[^\S\n]+'                    # Fecha valor (ignored)
+    r'(\S(?:.*?\S)?|[^\S\n](?=[^\S\n]\S))[^\S\n]+'  # Descripción (non-greedy)
+    r'([\d,]+\.\d{2})[^\S\n]+'                      # Monto (always positive)
+    r'([\d,]+\.\d{2})[^\S\n]*$',                    # Saldo
+    re.MULTILINE,
 )
 
 _BBVA_OPENING_BALANCE = re.compile(
@@ -181,10 +504,11 @@ _BBVA_OPENING_BALANCE = re.compile(
 #        "6/02/2026 CENTRAL DE C PAGO-PSE-259595580 -9.900.000,00 1.492.707,31"
 # Continuation lines (reference numbers): "NE:0015353485-NCN:000001", "PSE B-000042942839"
 _COLPATRIA_PATTERN = re.compile(
-    r'^(\d{1,2}/\d{2}/\d{4})\s+'  # FECHA: D/MM/YYYY
-    r'(.+?)\s+'                     # OFICINA + No DOCUM + DESCRIPCION
-    r'(-?[\d.]+,\d{2})\s+'        # MONTO (Colombian format, may be negative)
-    r'([\d.]+,\d{2})\s*$'         # SALDO
+    r'^[^\S\n]*(\d{1,2}/\d{2}/\d{4})[^\S\n]+'       # FECHA: D/MM/YYYY
+    r'(\S(?:.*?\S)?|[^\S\n](?=[^\S\n]\S))[^\S\n]+'  # OFICINA + No DOCUM + DESCRIPCION
+    r'(-?[\d.]+,\d{2})[^\S\n]+'                     # MONTO (Colombian format, may be negative)
+    r'([\d.]+,\d{2})[^\S\n]*$',                     # SALDO
+    re.MULTILINE,
 )
 _COLPATRIA_CONTINUATION = re.compile(
     r'^(NE:|PSE |NUMERO DE LOTE:|[A-Z0-9]+-[A-Z0-9]+-\d)',
@@ -194,56 +518,70 @@ _COLPATRIA_CONTINUATION = re.compile(
 
 def _parse_bancolombia_text(full_text):
     """Parse Bancolombia plain-text statement (single VALOR column + SALDO)."""
-    rows = []
-    for line in full_text.split('\n'):
-        m = _BANCOLOMBIA_PATTERN.match(line.strip())
-        if not m:
-            continue
-        fecha, desc, valor_str, saldo_str = m.groups()
-        valor = clean_number(valor_str)
-        saldo = clean_number(saldo_str)
-        rows.append({
-            'Fecha': fecha,
-            'Descripción': desc.strip(),
-            'Entradas': valor if isinstance(valor, (int, float)) and valor > 0 else None,
-            'Salidas': abs(valor) if isinstance(valor, (int, float)) and valor < 0 else None,
-            'Saldo': saldo,
-        })
-    return pd.DataFrame(rows) if rows else None
+    return _bancolombia_frame(m.groups() for m in _BANCOLOMBIA_PATTERN.finditer(full_text))
+
+
+def _bancolombia_frame(matches):
+    """Bancolombia DataFrame from (fecha, desc, valor, saldo) group tuples, or None."""
+    fechas, descs, valores, saldos = [], [], [], []
+    for fecha, desc, valor_str, saldo_str in matches:
+        fechas.append(fecha)
+        descs.append(desc.strip())
+        valores.append(valor_str)
+        saldos.append(saldo_str)
+    if not fechas:
+        return None
+
+    valor = clean_number_series(pd.Series(valores))
+    return pd.DataFrame({
+        'Fecha': fechas,
+        'Descripción': descs,
+        'Entradas': valor.where(valor > 0),
+        'Salidas': (-valor).where(valor < 0),
+        'Saldo': clean_number_series(pd.Series(saldos)),
+    })
 
 
 def _parse_davivienda_text(full_text):
     """Parse Davivienda plain-text statement (separate Débito / Crédito columns)."""
-    rows = []
-    lines = full_text.split('\n')
+    matches = ((m.groups(), m.end()) for m in _DAVIVIENDA_PATTERN.finditer(full_text))
+    return _davivienda_frame(full_text, matches)
 
-    for i, line in enumerate(lines):
-        m = _DAVIVIENDA_PATTERN.match(line.strip())
-        if not m:
-            continue
-        dia, mes, desc_raw, deb_str, cre_str = m.groups()
 
+def _davivienda_frame(full_text, matches):
+    """Davivienda DataFrame from (groups, match end) pairs found in full_text, or None."""
+    fechas, descs, debitos, creditos = [], [], [], []
+
+    for (dia, mes, desc_raw, deb_str, cre_str), end in matches:
         # Append continuation line to description when the next line is not a new
-        # transaction and not a known header/footer.
+        # transaction and not a known header/footer. The match ends right before
+        # the newline, so the next line starts one character later.
         desc = desc_raw.strip()
-        if i + 1 < len(lines):
-            nxt = lines[i + 1].strip()
+        if end < len(full_text):
+            nxt_start = end + 1
+            nxt_end = full_text.find('\n', nxt_start)
+            nxt = full_text[nxt_start:nxt_end if nxt_end != -1 else None].strip()
             if (nxt
                     and not _DAVIVIENDA_PATTERN.match(nxt)
                     and not _DAVI_SKIP.match(nxt)):
                 desc = desc + ' ' + nxt
 
-        debito = clean_number(deb_str)
-        credito = clean_number(cre_str)
+        fechas.append(f'{dia}/{mes}')
+        descs.append(desc)
+        debitos.append(deb_str)
+        creditos.append(cre_str)
 
-        rows.append({
-            'Fecha': f'{dia}/{mes}',
-            'Descripción': desc,
-            'Entradas': credito if isinstance(credito, (int, float)) and credito > 0 else None,
-            'Salidas': debito if isinstance(debito, (int, float)) and debito > 0 else None,
-        })
+    if not fechas:
+        return None
 
-    return pd.DataFrame(rows) if rows else None
+    debito = clean_number_series(pd.Series(debitos))
+    credito = clean_number_series(pd.Series(creditos))
+    return pd.DataFrame({
+        'Fecha': fechas,
+        'Descripción': descs,
+        'Entradas': credito.where(credito > 0),
+        'Salidas': debito.where(debito > 0),
+    })
 
 
 def _parse_colpatria_text(full_text):
@@ -253,34 +591,37 @@ def _parse_colpatria_text(full_text):
     Colombian number format (dot=thousands, comma=decimal).
     Negative AMOUNT → Salida; positive → Entrada.
     """
-    rows = []
-    lines = full_text.split('\n')
+    fechas, descs, montos, saldos = [], [], [], []
 
-    for i, line in enumerate(lines):
-        m = _COLPATRIA_PATTERN.match(line.strip())
-        if not m:
-            continue
+    for m in _COLPATRIA_PATTERN.finditer(full_text):
         fecha, desc_raw, monto_str, saldo_str = m.groups()
         desc = desc_raw.strip()
 
-        # Append continuation/reference line to description
-        if i + 1 < len(lines):
-            nxt = lines[i + 1].strip()
+        # Append continuation/reference line to description (same slicing as
+        # _parse_davivienda_text: the match ends right before the newline)
+        if m.end() < len(full_text):
+            nxt_start = m.end() + 1
+            nxt_end = full_text.find('\n', nxt_start)
+            nxt = full_text[nxt_start:nxt_end if nxt_end != -1 else None].strip()
             if nxt and _COLPATRIA_CONTINUATION.match(nxt) and len(nxt) < 60:
                 desc = desc + ' ' + nxt
 
-        monto = clean_number(monto_str)
-        saldo = clean_number(saldo_str)
+        fechas.append(fecha)
+        descs.append(desc)
+        montos.append(monto_str)
+        saldos.append(saldo_str)
 
-        rows.append({
-            'Fecha': fecha,
-            'Descripción': desc,
-            'Entradas': monto if isinstance(monto, (int, float)) and monto > 0 else None,
-            'Salidas': abs(monto) if isinstance(monto, (int, float)) and monto < 0 else None,
-            'Saldo': saldo,
-        })
+    if not fechas:
+        return None
 
-    return pd.DataFrame(rows) if rows else None
+    monto = clean_number_series(pd.Series(montos))
+    return pd.DataFrame({
+        'Fecha': fechas,
+        'Descripción': descs,
+        'Entradas': monto.where(monto > 0),
+        'Salidas': (-monto).where(monto < 0),
+        'Saldo': clean_number_series(pd.Series(saldos)),
+    })
 
 
 def _parse_bbva_text(full_text):
@@ -293,10 +634,7 @@ def _parse_bbva_text(full_text):
     prev_balance = clean_number(ob_match.group(1)) if ob_match else None
 
     rows = []
-    for line in full_text.split('\n'):
-        m = _BBVA_PATTERN.match(line.strip())
-        if not m:
-            continue
+    for m in _BBVA_PATTERN.finditer(full_text):
         fecha, desc, amount_str, balance_str = m.groups()
         amount = clean_number(amount_str)
         curr_balance = clean_number(balance_str)
@@ -322,11 +660,38 @@ def _parse_bbva_text(full_text):
     return pd.DataFrame(rows) if rows else None
 
 
+# Bank names that identify a plain-text format from the statement header
+_TEXT_PARSER_BY_BANK = (
+    ('DAVIVIENDA', _parse_davivienda_text),
+    ('BANCOLOMBIA', _parse_bancolombia_text),
+)
+
+
 def _parse_text_transactions(full_text):
-    """Try all known plain-text parsers and return the one with most rows."""
+    """Parse plain-text transactions.
+
+    If the header (first 2000 chars) names a known bank, only that bank's
+    parser runs (earliest name wins). Otherwise, or if it finds nothing, try
+    all known plain-text parsers and return the one with most rows.
+    """
+    header = full_text[:2000].upper()
+    named = [(header.find(bank), parser) for bank, parser in _TEXT_PARSER_BY_BANK if bank in header]
+    if named:
+        parser = min(named, key=lambda item: item[0])[1]
+        df = parser(full_text)
+        if df is not None and not df.empty:
+            return df
+
+    davi, banco = [], []
+    for m in _DAVI_OR_BANCO.finditer(full_text):
+        if m.lastgroup == 'davi':
+            davi.append((m.groups()[_DAVI_GROUPS], m.end()))
+        else:
+            banco.append(m.groups()[_BANCO_GROUPS])
+
     candidates = [
-        _parse_davivienda_text(full_text),
-        _parse_bancolombia_text(full_text),
+        _davivienda_frame(full_text, davi),
+        _bancolombia_frame(banco),
         _parse_bbva_text(full_text),
         _parse_colpatria_text(full_text),
     ]
@@ -336,58 +701,60 @@ def _parse_text_transactions(full_text):
     return max(candidates, key=len)
 
 
+# Cell contains something that looks like an amount
+_MONETARY_RE = re.compile(r'\d[\d.,]+')
+# Everything except digits and separators (signs, parentheses, currency)
+_NON_NUMERIC_RE = re.compile(r'[^\d.,]')
+# Column-name keywords (matched against the lowercased header)
+_DEBIT_RE = re.compile(r'débit|debito|cargo|salida|egreso|retiro')
+_CREDIT_RE = re.compile(r'crédit|credito|abono|entrada|ingreso|depósito|deposito')
+
+
 def _process_table_data(headers, rows):
     """Build DataFrame from table rows and add Entradas/Salidas columns."""
     df = pd.DataFrame(rows, columns=headers)
-    col_lower = {col: col.lower() for col in df.columns}
-
-    debit_cols = [
-        col for col, lower in col_lower.items()
-        if any(k in lower for k in ['débit', 'debito', 'cargo', 'salida', 'egreso', 'retiro'])
-    ]
-    credit_cols = [
-        col for col, lower in col_lower.items()
-        if any(k in lower for k in ['crédit', 'credito', 'abono', 'entrada', 'ingreso', 'depósito', 'deposito'])
-    ]
+    debit_cols = [col for col in df.columns if _DEBIT_RE.search(col.lower())]
+    credit_cols = [col for col in df.columns if _CREDIT_RE.search(col.lower())]
 
     if debit_cols and credit_cols:
-        df['Salidas'] = df[debit_cols[0]].apply(clean_number)
-        df['Entradas'] = df[credit_cols[0]].apply(clean_number)
+        df['Salidas'] = clean_number_series(df[debit_cols[0]])
+        df['Entradas'] = clean_number_series(df[credit_cols[0]])
     else:
-        monetary_pattern = re.compile(r'\d[\d.,]+')
-        best_col, best_count = None, 0
-        for col in df.columns:
-            count = df[col].apply(
-                lambda v: bool(monetary_pattern.search(str(v))) if v else False
-            ).sum()
-            if count > best_count:
-                best_count, best_col = count, col
+        # Column with the most amount-looking cells (first one wins on ties)
+        counts = {
+            col: df[col].astype('string').str.contains(_MONETARY_RE, regex=True, na=False).sum()
+            for col in df.columns
+        }
+        best_col = max(counts, key=counts.get) if counts else None
+        if best_col is not None and counts[best_col] == 0:
+            best_col = None
 
         if best_col:
-            def to_signed(val):
-                if not val:
-                    return None
-                s = str(val).strip()
-                is_neg = s.startswith('-') or '(' in s
-                num = clean_number(re.sub(r'[^\d.,]', '', s))
-                return (-num if is_neg else num) if isinstance(num, (int, float)) else None
-
-            df['_amount'] = df[best_col].apply(to_signed)
-            df['Entradas'] = df['_amount'].apply(lambda x: x if isinstance(x, (int, float)) and x > 0 else None)
-            df['Salidas'] = df['_amount'].apply(lambda x: abs(x) if isinstance(x, (int, float)) and x < 0 else None)
-            df = df.drop(columns=['_amount'])
+            # Sign comes from a leading '-' or accounting parentheses; the rest
+            # is stripped to digits/separators and parsed in one vectorized pass
+            raw = df[best_col].astype('string').str.strip()
+            is_neg = (raw.str.startswith('-') | raw.str.contains('(', regex=False)).fillna(False)
+            amounts = pd.to_numeric(
+                clean_number_series(raw.str.replace(_NON_NUMERIC_RE, '', regex=True)),
+                errors='coerce',
+            )
+            amounts = amounts.where(~is_neg, -amounts)
+            df['Entradas'] = amounts.where(amounts > 0)
+            df['Salidas'] = (-amounts).where(amounts < 0)
 
     return df
 
 
 # Keywords that indicate a table is a transaction table (not a summary table)
 _TX_HEADER_KEYWORDS = {'fecha', 'descripci', 'movimiento', 'concepto', 'detalle', 'transacci'}
+# Same keywords as one alternation: the joined header is scanned once
+_TX_HEADER_RE = re.compile('|'.join(map(re.escape, sorted(_TX_HEADER_KEYWORDS))))
 
 
 def _is_transaction_table(header_row):
     """Return True if the header row looks like a financial transaction table."""
     combined = ' '.join(str(h or '').lower() for h in header_row)
-    return any(kw in combined for kw in _TX_HEADER_KEYWORDS)
+    return _TX_HEADER_RE.search(combined) is not None
 
 
 # ── Adquirencia (datáfonos) ───────────────────────────────────────────────────
@@ -443,35 +810,16 @@ def _parse_adquirencia_tables(all_tables):
     return pd.DataFrame(rows) if rows else None
 
 
-def extract_bank_statement(pdf_stream):
-    """Extract transactions from a bank statement PDF.
+def _parse_generic_tables(all_tables):
+    """Collect rows from tables whose header looks like a transaction table.
 
-    Strategy:
-    1a. Adquirencia (datáfonos) — detected by 13-col table with 'Vr Abono' header.
-    1b. Generic table extraction — tables whose header contains transaction keywords.
-    2.  Text parsing fallback — known plain-text formats (BBVA, Davivienda, Bancolombia).
+    The first qualifying table fixes the headers; later tables (page
+    continuations) contribute rows with the same width, skipping repeated
+    header rows. Needs at least 5 rows to be trusted.
     """
-    all_page_tables = []
-    all_text_parts = []
-
-    with pdfplumber.open(pdf_stream) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text()
-            if text:
-                all_text_parts.append(text)
-            for table in page.extract_tables():
-                if table:
-                    all_page_tables.append(table)
-
-    # Strategy 1a — Adquirencia datáfonos
-    adq_df = _parse_adquirencia_tables(all_page_tables)
-    if adq_df is not None and not adq_df.empty:
-        return adq_df
-
-    # Strategy 1b — Generic transaction tables
     headers = None
     all_table_rows = []
-    for table in all_page_tables:
+    for table in all_tables:
         if len(table) < 2:
             continue
         max_cols = max((len(row) for row in table if row), default=0)
@@ -479,13 +827,14 @@ def extract_bank_statement(pdf_stream):
             continue
 
         if headers is None:
-            candidate = [
+            # Vet the raw header row first; only a qualifying table pays for
+            # building the normalized header list.
+            if not _is_transaction_table(table[0]):
+                continue
+            headers = [
                 str(h).strip() if h else f"Col{i}"
                 for i, h in enumerate(table[0])
             ]
-            if not _is_transaction_table(candidate):
-                continue
-            headers = candidate
             for row in table[1:]:
                 if len(row) == len(headers) and any(c for c in row if c):
                     all_table_rows.append(list(row))
@@ -500,8 +849,72 @@ def extract_bank_statement(pdf_stream):
 
     if all_table_rows and len(all_table_rows) >= 5:
         return _process_table_data(headers, all_table_rows)
+    return None
+
+
+def _page_tables(page):
+    """Non-empty tables on one page (a _map_pages page function)."""
+    return [table for table in page.extract_tables() if table]
+
+
+def _extract_text_fast(pdf_stream):
+    """Plain text of every page via PDFium (C library, no layout analysis).
+
+    Much faster than pdfplumber's extract_text when only the text stream is
+    needed. Line endings are normalized to '\\n' for the MULTILINE patterns.
+    The whole page walk runs inside _open_pdfium, i.e. under _PDFIUM_LOCK:
+    this is called from the request threadpool for long PDFs and on
+    single-CPU hosts, where several bank uploads may be in flight.
+    """
+    parts = []
+    with _open_pdfium(pdf_stream) as doc:
+        for i in range(len(doc)):
+            page = doc[i]
+            textpage = page.get_textpage()
+            parts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+    return '\n'.join(parts).replace('\r\n', '\n')
+
+
+def extract_bank_statement(pdf_stream):
+    """Extract transactions from a bank statement PDF.
+
+    Strategy:
+    1a. Adquirencia (datáfonos) — detected by 13-col table with 'Vr Abono' header.
+    1b. Generic table extraction — tables whose header contains transaction keywords.
+    2.  Text parsing fallback — known plain-text formats (BBVA, Davivienda, Bancolombia,
+        Colpatria), on PDFium text first and pdfplumber text if that finds nothing.
+    """
+    with _open_pdf(pdf_stream) as pdf:
+        all_page_tables = _map_pages(_page_tables, pdf, pdf_stream)
+
+        # Strategy 1a — Adquirencia datáfonos
+        adq_df = _parse_adquirencia_tables(all_page_tables)
+        if adq_df is not None and not adq_df.empty:
+            return adq_df
+
+        # Strategy 1b — Generic transaction tables
+        table_df = _parse_generic_tables(all_page_tables)
+        if table_df is not None:
+            return table_df
+
+        # Strategy 2 — Text parsing (BBVA, Davivienda, Bancolombia, Colpatria).
+        # Only reached when no table strategy matched. PDFium's plain text is
+        # tried first; pdfplumber's laid-out text only if the fast text yields
+        # no rows. On the serial path extract_text reuses the pages already
+        # parsed for their tables; when _map_pages used worker processes the
+        # parent's pages were never parsed, so each one is parsed here.
+        text_df = _parse_text_transactions(_extract_text_fast(pdf_stream))
+        if text_df is not None:
+            return text_df
+
+        all_text_parts = []
+        for page in pdf.pages:
+            text = page.extract_text()
+            if text:
+                all_text_parts.append(text)
 
-    # Strategy 2 — Text parsing (BBVA, Davivienda, Bancolombia)
     full_text = '\n'.join(all_text_parts)
     return _parse_text_transactions(full_text)
 
@@ -510,45 +923,153 @@ def extract_bank_statement(pdf_stream):
 # ENDPOINTS
 # ─────────────────────────────────────────────
 
-@app.post("/uploadfile/")
-async def create_upload_file(file: UploadFile = File(...)):
-    pdf_content = await file.read()
-    with io.BytesIO(pdf_content) as pdf_stream:
-        data_frames = extract_data_from_pdf(pdf_stream)
+_XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Workbook options. Small workbooks use in_memory, which keeps xlsxwriter from
+# writing every XML part to a temp file and reading it back into the zip. Large
+# ones use constant_memory: each row is flushed to the sheet's temp file as it
+# is written, so peak memory stays at about one row (in_memory would override
+# it, so the two are never combined).
+_XLSX_OPTIONS = {'in_memory': True}
+_XLSX_LARGE_OPTIONS = {'constant_memory': True}
+_XLSX_LARGE_CELLS = 100_000
+# DataFrames are converted to Python rows this many at a time
+_XLSX_ROW_BLOCK = 5_000
+# Header cell style pandas 2.x applies in to_excel (the version on Python 3.9)
+_XLSX_HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+
+
+def _df_rows(df):
+    """Rows of df as tuples, missing values as None, converted block by block."""
+    for start in range(0, len(df), _XLSX_ROW_BLOCK):
+        block = df.iloc[start:start + _XLSX_ROW_BLOCK]
+        yield from block.astype(object).where(block.notna(), None).itertuples(index=False, name=None)
+
+
+def _build_xlsx(sheets):
+    """Write {sheet_name: DataFrame | list of rows} to an in-memory .xlsx buffer.
+
+    Rows go straight to xlsxwriter worksheets, in order: DataFrames via
+    _df_rows (missing values as blank cells, header in the style to_excel
+    uses), lists of rows with their header as the first row. This skips the
+    per-cell objects pandas' to_excel builds before handing values to the
+    writer. Workbooks over _XLSX_LARGE_CELLS cells use constant_memory.
+    """
+    cells = sum(data.size if isinstance(data, pd.DataFrame) else sum(map(len, data))
+                for data in sheets.values())
+    options = _XLSX_LARGE_OPTIONS if cells > _XLSX_LARGE_CELLS else _XLSX_OPTIONS
 
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        data_frames["Info"].to_excel(writer, index=False, sheet_name='Info')
-        data_frames["Items"].to_excel(writer, index=False, sheet_name='Items')
+    with xlsxwriter.Workbook(output, options) as book:
+        header_format = book.add_format(_XLSX_HEADER_FORMAT)
+        for name, data in sheets.items():
+            if isinstance(data, pd.DataFrame):
+                header = list(data.columns)
+                body = _df_rows(data)
+            else:
+                header, body = data[0], data[1:]
+            ws = book.add_worksheet(name)
+            ws.write_row(0, 0, header, header_format)
+            for r, row in enumerate(body, start=1):
+                ws.write_row(r, 0, row)
     output.seek(0)
+    return output
+
+
+# Recent export results keyed by (job name, digest of the upload), so a PDF
+# that is submitted again is answered without parsing it. Values are the
+# immutable xlsx bytes (or None). Only touched from the event loop — no lock.
+_EXPORT_CACHE = OrderedDict()
+_EXPORT_CACHE_SIZE = 32
+
+
+async def _run_in_pool(pool, func, *args):
+    """await func(*args) in pool; a broken pool is discarded before re-raising."""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+
+
+async def _run_export(export, file):
+    """Run export(pdf) -> xlsx bytes | None off the event loop, with caching.
+
+    A parse running in a thread holds the GIL, so concurrent uploads would
+    still take turns. Short PDFs therefore run whole in a worker process.
+    PDFs long enough for _map_pages to split are driven from a thread that
+    fans their pages out over the same pool (a worker can't submit to it).
+
+    The upload stays in its SpooledTemporaryFile (on disk once it is large):
+    the digest and page count read it in place, threadpool runs get the
+    stream itself, and the bytes are only read into memory for a worker.
+    """
+    await file.seek(0)
+    pdf_stream = file.file
+
+    key = (export.__name__, await run_in_threadpool(_upload_digest, pdf_stream))
+    if key in _EXPORT_CACHE:
+        _EXPORT_CACHE.move_to_end(key)
+        return _EXPORT_CACHE[key]
+
+    if (os.cpu_count() or 1) < 2 or await run_in_threadpool(_page_count, pdf_stream) >= _PARALLEL_MIN_PAGES:
+        result = await run_in_threadpool(export, pdf_stream)
+    else:
+        pdf_bytes = await file.read()
+        try:
+            result = await _run_in_pool(_process_pool(), export, pdf_bytes)
+        except BrokenProcessPool:
+            # A worker died (OOM, crash on a bad PDF): retry once on a new pool
+            result = await _run_in_pool(_process_pool(), export, pdf_bytes)
+
+    _EXPORT_CACHE[key] = result
+    if len(_EXPORT_CACHE) > _EXPORT_CACHE_SIZE:
+        _EXPORT_CACHE.popitem(last=False)
+    return result
+
+
+# Export jobs: module-level, PDF bytes or stream in, xlsx bytes out, so they
+# pickle for the pool
+
+def _invoice_export(pdf):
+    """DIAN invoice PDF → xlsx bytes (Info + Items sheets)."""
+    data_frames = extract_data_from_pdf(pdf)
+    return _build_xlsx({'Info': data_frames["Info"], 'Items': data_frames["Items"]}).getvalue()
+
+
+def _bank_export(pdf):
+    """Bank statement PDF → xlsx bytes, or None when no transactions are found."""
+    df = extract_bank_statement(pdf)
+    if df is None or df.empty:
+        return None
+    return _build_xlsx({'Movimientos': df}).getvalue()
+
+
+@app.post("/uploadfile/")
+async def create_upload_file(file: UploadFile = File(...)):
+    output = await _run_export(_invoice_export, file)
 
     return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        io.BytesIO(output),
+        media_type=_XLSX_MEDIA_TYPE,
         headers={"Content-Disposition": "attachment; filename=factura_export.xlsx"}
     )
 
 
 @app.post("/upload-bank/")
 async def upload_bank_statement(file: UploadFile = File(...)):
-    pdf_content = await file.read()
-    with io.BytesIO(pdf_content) as pdf_stream:
-        df = extract_bank_statement(pdf_stream)
+    output = await _run_export(_bank_export, file)
 
-    if df is None or df.empty:
+    if output is None:
         return JSONResponse(
             status_code=422,
             content={"error": "No se encontraron transacciones en el PDF."}
         )
 
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Movimientos')
-    output.seek(0)
-
     return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        io.BytesIO(output),
+        media_type=_XLSX_MEDIA_TYPE,
         headers={"Content-Disposition": "attachment; filename=extracto_export.xlsx"}
     )
 
@@ -581,6 +1102,16 @@ _PLANILLA_COLS_43 = {
     'Exonerado': 41, 'Total': 42,
 }
 
+# Both layouts map the same fields in the same order (keep it that way);
+# rows are built as tuples in this order
+_PLANILLA_FIELDS = list(_PLANILLA_COLS_52)
+# Source column of each field per table width, for pulling them out of a table
+# in one indexing step. Other widths are summary / unknown tables.
+_PLANILLA_LAYOUTS = {
+    52: np.array(list(_PLANILLA_COLS_52.values())),
+    43: np.array(list(_PLANILLA_COLS_43.values())),
+}
+
 _PLANILLA_MONEY = {
     'Pension_IBC', 'Pension_Aporte', 'Salud_IBC', 'Salud_Aporte',
     'CCF_IBC', 'CCF_Aporte', 'Riesgo_IBC', 'Riesgo_Aporte',
@@ -588,6 +1119,52 @@ _PLANILLA_MONEY = {
 }
 _PLANILLA_INT = {'Pension_Dias', 'Salud_Dias', 'CCF_Dias', 'Riesgo_Dias', 'Paraf_Dias'}
 
+# Per-field cell handlers; each gets the stripped, non-empty cell text
+
+
+def _pila_codigo(val):
+    # Code and sub-code may be joined with newline; keep first line
+    return val.split('\n')[0].strip()
+
+
+def _pila_tarifa(val):
+    val = val.replace('%', '').strip()
+    try:
+        return float(val)
+    except ValueError:
+        return val
+
+
+def _pila_money(val):
+    return val  # cleaned per column in extract_planilla_pila
+
+
+def _pila_int(val):
+    try:
+        return int(val.split('\n')[0].strip())
+    except ValueError:
+        return val
+
+
+def _pila_text(val):
+    return val.replace('\n', ' ')
+
+
+def _planilla_handler(field):
+    if field == 'Pension_Codigo':
+        return _pila_codigo
+    if field == 'Riesgo_Tarifa':
+        return _pila_tarifa
+    if field in _PLANILLA_MONEY:
+        return _pila_money
+    if field in _PLANILLA_INT:
+        return _pila_int
+    return _pila_text
+
+
+# Handler for each field, in _PLANILLA_FIELDS order — chosen once, not per cell
+_PLANILLA_HANDLERS = [_planilla_handler(field) for field in _PLANILLA_FIELDS]
+
 _PLANILLA_RENAME = {
     'No': 'No.', 'ID': 'Identificación',
     'Pension_Codigo': 'Pensión_Código', 'Pension_Dias': 'Pensión_Días',
@@ -604,6 +1181,30 @@ _PLANILLA_RENAME = {
 }
 
 
+def _planilla_page_rows(page):
+    """Employee rows (tuples in _PLANILLA_FIELDS order) from the 52/43-column tables on one page."""
+    rows = []
+    for found in page.find_tables():
+        # An extracted row has one cell per distinct cell x0, so the layout is
+        # known before paying for extract(), which scans the page chars per row
+        cols = _PLANILLA_LAYOUTS.get(len({cell[0] for cell in found.cells}))
+        if cols is None:
+            continue  # skip summary / unknown tables
+        table = found.extract()
+
+        # pdfplumber tables are rectangular. Only employee rows — first cell is
+        # a plain integer (None becomes 'None' and fails, like before)
+        arr = np.array(table, dtype=object)
+        is_employee = np.char.isdigit(np.char.strip(arr[:, 0].astype(str)))
+
+        for row in arr[is_employee][:, cols]:
+            rows.append(tuple(
+                handle(str(val).strip()) if val not in (None, '') else None
+                for handle, val in zip(_PLANILLA_HANDLERS, row)
+            ))
+    return rows
+
+
 def extract_planilla_pila(pdf_stream):
     """Extract per-employee data from a Planilla PILA (Colombian social security) PDF.
 
@@ -611,89 +1212,49 @@ def extract_planilla_pila(pdf_stream):
     - 52-column (page 1): wider due to extra novedad columns on the left.
     - 43-column (pages 2+): standard layout for the rest of the document.
     """
-    rows = []
-
-    with pdfplumber.open(pdf_stream) as pdf:
-        for page in pdf.pages:
-            for table in page.extract_tables():
-                if not table or not table[0]:
-                    continue
-                ncols = len(table[0])
-                if ncols == 52:
-                    col_map = _PLANILLA_COLS_52
-                elif ncols == 43:
-                    col_map = _PLANILLA_COLS_43
-                else:
-                    continue  # skip summary / unknown tables
-
-                for row in table:
-                    if not row or not row[0]:
-                        continue
-                    # Only employee rows — first cell is a plain integer
-                    if not str(row[0]).strip().isdigit():
-                        continue
-
-                    record = {}
-                    for field, ci in col_map.items():
-                        val = row[ci] if ci < len(row) else None
-                        if val not in (None, ''):
-                            val = str(val).strip()
-                            if field == 'Pension_Codigo':
-                                # Code and sub-code may be joined with newline; keep first line
-                                val = val.split('\n')[0].strip()
-                            elif field == 'Riesgo_Tarifa':
-                                val = val.replace('%', '').strip()
-                                try:
-                                    val = float(val)
-                                except ValueError:
-                                    pass
-                            elif field in _PLANILLA_MONEY:
-                                val = clean_number(val)
-                            elif field in _PLANILLA_INT:
-                                try:
-                                    val = int(val.split('\n')[0].strip())
-                                except ValueError:
-                                    pass
-                            else:
-                                val = val.replace('\n', ' ')
-                        else:
-                            val = None
-                        record[field] = val
-
-                    rows.append(record)
+    with _open_pdf(pdf_stream) as pdf:
+        rows = _map_pages(_planilla_page_rows, pdf, pdf_stream)
 
     if not rows:
         return None
 
-    df = pd.DataFrame(rows).rename(columns=_PLANILLA_RENAME)
-    return df
+    df = pd.DataFrame(rows, columns=_PLANILLA_FIELDS)
+    for col in _PLANILLA_MONEY:
+        df[col] = clean_number_series(df[col])
+    return df.rename(columns=_PLANILLA_RENAME)
+
+
+def _planilla_export(pdf):
+    """Planilla PILA PDF → xlsx bytes, or None when no employee rows are found."""
+    df = extract_planilla_pila(pdf)
+    if df is None or df.empty:
+        return None
+    return _build_xlsx({'Empleados': df}).getvalue()
 
 
 @app.post("/upload-planilla/")
 async def upload_planilla(file: UploadFile = File(...)):
-    pdf_content = await file.read()
-    with io.BytesIO(pdf_content) as pdf_stream:
-        df = extract_planilla_pila(pdf_stream)
+    output = await _run_export(_planilla_export, file)
 
-    if df is None or df.empty:
+    if output is None:
         return JSONResponse(
             status_code=422,
             content={"error": "No se encontraron datos de empleados en el PDF."}
         )
 
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Empleados')
-    output.seek(0)
-
     return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        io.BytesIO(output),
+        media_type=_XLSX_MEDIA_TYPE,
         headers={"Content-Disposition": "attachment; filename=planilla_pila.xlsx"}
     )
 
 
+# Read once at import; uvicorn --reload restarts the process when it changes
+# (see --reload-include in the README).
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "index.html"), "rb") as _f:
+    _INDEX_HTML = _f.read()
+
+
 @app.get("/")
 async def main():
-    with open("index.html") as f:
-        return HTMLResponse(content=f.read(), status_code=200)
+    return HTMLResponse(content=_INDEX_HTML, status_code=200)
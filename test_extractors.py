@@ -1,12 +1,28 @@
-"""Tests for PDF extractors: clean_number, BBVA, and Adquirencia."""
+"""Tests for PDF extractors: clean_number, invoice header, text parsers, and Adquirencia."""
 import io
+from concurrent.futures.process import BrokenProcessPool
 import pytest
 from main import (
     clean_number,
+    clean_number_series,
+    _clean_number_str,
     extract_bank_statement,
+    _parse_invoice_header,
+    _parse_bancolombia_text,
+    _parse_davivienda_text,
+    _parse_text_transactions,
     _parse_bbva_text,
+    _parse_colpatria_text,
     _parse_adquirencia_tables,
+    _process_table_data,
+    _read_pdf_bytes,
+    _open_pdfium,
+    _page_count,
+    _extract_text_fast,
+    _PDFIUM_LOCK,
     _is_adquirencia_table,
+    _planilla_page_rows,
+    _PLANILLA_FIELDS,
     _BBVA_PATTERN,
     _BBVA_OPENING_BALANCE,
 )
@@ -18,6 +34,11 @@ ADQUIRENCIA_PDF = "pdf/Extracto datáfonos Adquirencia Feb 2026.pdf"
 # ── clean_number ──────────────────────────────────────────────────────────────
 
 class TestCleanNumber:
+    def test_plain_integer(self):
+        assert clean_number(" 1300000 ") == 1300000
+        assert clean_number("$007") == 7
+        assert isinstance(clean_number("1300000"), int)
+
     def test_multiple_dots_thousands(self):
         assert clean_number("$ 1.225.000") == 1225000
 
@@ -55,6 +76,327 @@ class TestCleanNumber:
         # "35,850" — comma with 3 trailing digits → thousands separator
         assert clean_number("35,850") == 35850
 
+    def test_numeric_passthrough(self):
+        assert clean_number(1225000) == 1225000
+        assert clean_number(336050.42) == 336050.42
+
+    def test_integral_float_becomes_int(self):
+        result = clean_number(19.0)
+        assert result == 19 and isinstance(result, int)
+
+    def test_nan_returns_none(self):
+        assert clean_number(float("nan")) is None
+
+    def test_unparseable_returns_original(self):
+        assert clean_number("N/A") == "N/A"
+
+    def test_repeated_value_is_cached(self):
+        clean_number("$ 7.777.777")
+        hits = _clean_number_str.cache_info().hits
+        assert clean_number("$ 7.777.777") == 7777777
+        assert _clean_number_str.cache_info().hits == hits + 1
+
+
+# ── clean_number_series ──────────────────────────────────────────────────────
+
+class TestCleanNumberSeries:
+    VALUES = [
+        "$ 1.225.000", "$ 336.050,42", "$212,700", "24,300.00", "2,545,068.95",
+        "1234", "0", "35,850", ".86", "1,00", "-24,300.00",
+    ]
+
+    def test_matches_clean_number(self):
+        import pandas as pd
+        result = clean_number_series(pd.Series(self.VALUES))
+        assert result.tolist() == pytest.approx([clean_number(v) for v in self.VALUES])
+
+    def test_empty_values_are_nan(self):
+        import pandas as pd
+        result = clean_number_series(pd.Series([None, "", "-", "$ "]))
+        assert result.isna().all()
+
+    def test_unparseable_keeps_original(self):
+        import pandas as pd
+        result = clean_number_series(pd.Series(["1.225.000", "N/A"]))
+        assert result.iloc[0] == 1225000
+        assert result.iloc[1] == "N/A"
+
+    def test_outliers_use_scalar_path(self):
+        import pandas as pd
+        values = ["1 234", "(1,000)", "1e5", "COP 5"]
+        result = clean_number_series(pd.Series(values))
+        assert result.tolist() == [clean_number(v) for v in values]
+
+
+# ── PDF access helpers ────────────────────────────────────────────────────────
+
+class TestReadPdfBytes:
+    def test_bytes_returned_as_is(self):
+        data = b"%PDF-1.4 ..."
+        assert _read_pdf_bytes(data) is data
+
+    def test_stream_position_preserved(self):
+        stream = io.BytesIO(b"%PDF-1.4 ...")
+        stream.seek(5)
+        assert _read_pdf_bytes(stream) == b"%PDF-1.4 ..."
+        assert stream.tell() == 5
+
+
+def _blank_pdf(npages):
+    import pypdfium2 as pdfium
+    doc = pdfium.PdfDocument.new()
+    for _ in range(npages):
+        doc.new_page(612, 792).close()
+    buf = io.BytesIO()
+    doc.save(buf)
+    doc.close()
+    return buf.getvalue()
+
+
+class TestOpenPdfium:
+    def test_lock_held_until_close(self):
+        with _open_pdfium(_blank_pdf(1)):
+            assert _PDFIUM_LOCK.locked()
+        assert not _PDFIUM_LOCK.locked()
+
+    def test_page_count_keeps_stream_position(self):
+        stream = io.BytesIO(_blank_pdf(3))
+        stream.seek(7)
+        assert _page_count(stream) == 3
+        assert stream.tell() == 7 and not _PDFIUM_LOCK.locked()
+
+    @pytest.mark.parametrize("max_size", [0, 1 << 20])  # rolled over to disk / in memory
+    def test_spooled_upload_file(self, max_size):
+        import tempfile
+        with tempfile.SpooledTemporaryFile(max_size=max_size) as spooled:
+            spooled.write(_blank_pdf(3))
+            spooled.seek(4)
+            assert _page_count(spooled) == 3
+            assert _extract_text_fast(spooled) == "\n\n"
+            assert spooled.tell() == 4
+
+    def test_bytearray(self):
+        assert _page_count(bytearray(_blank_pdf(2))) == 2
+
+    def test_fast_text_walks_pages_under_lock(self, monkeypatch):
+        import pypdfium2 as pdfium
+        text_range = pdfium.PdfTextPage.get_text_range
+        seen = []
+
+        def spy(self, *args, **kwargs):
+            seen.append(_PDFIUM_LOCK.locked())
+            return text_range(self, *args, **kwargs)
+
+        monkeypatch.setattr(pdfium.PdfTextPage, "get_text_range", spy)
+        _extract_text_fast(_blank_pdf(2))
+        assert seen == [True, True] and not _PDFIUM_LOCK.locked()
+
+
+class _BrokenPool:
+    def __init__(self):
+        self.shut_down = False
+
+    def submit(self, *args):
+        raise BrokenProcessPool("worker died")
+
+    def shutdown(self, **kwargs):
+        self.shut_down = True
+
+
+class TestProcessPoolRecovery:
+    def test_broken_pool_is_replaced_and_pages_retried(self, monkeypatch):
+        from concurrent.futures import ThreadPoolExecutor
+        import main
+        broken, fresh = _BrokenPool(), ThreadPoolExecutor(2)
+        monkeypatch.setattr(main, "_POOL", broken)
+        monkeypatch.setattr(main.os, "cpu_count", lambda: 2)
+        monkeypatch.setattr(main, "ProcessPoolExecutor", lambda **kwargs: fresh)
+        pdf_bytes = _blank_pdf(4)
+        with main._open_pdf(pdf_bytes) as pdf:
+            rows = main._map_pages(_page_number, pdf, pdf_bytes)
+        fresh.shutdown()
+        assert rows == [1, 2, 3, 4]
+        assert broken.shut_down and main._POOL is fresh
+
+    def test_run_in_pool_discards_broken_pool(self, monkeypatch):
+        import asyncio
+        import main
+        broken = _BrokenPool()
+        monkeypatch.setattr(main, "_POOL", broken)
+        with pytest.raises(BrokenProcessPool):
+            asyncio.run(main._run_in_pool(broken, len, b""))
+        assert broken.shut_down and main._POOL is None
+
+    def test_discard_keeps_a_replacement_pool(self, monkeypatch):
+        import main
+        old, current = _BrokenPool(), object()
+        monkeypatch.setattr(main, "_POOL", current)
+        main._discard_pool(old)
+        assert old.shut_down and main._POOL is current
+
+
+def _page_number(page):
+    return [page.page_number]
+
+
+# ── Invoice header ────────────────────────────────────────────────────────────
+
+class TestParseInvoiceHeader:
+    SAMPLE = (
+        "Razón Social: ACME S.A.S.\n"
+        "Nit del Emisor: 900123456\n"
+        "Datos del Adquiriente / Comprador\n"
+        "Nombre o Razón Social: CLIENTE LTDA\n"
+        "Tipo de Documento: NIT\n"
+        "Número Documento: 800987654\n"
+    )
+
+    def test_vendedor(self):
+        vendedor, _ = _parse_invoice_header(self.SAMPLE)
+        assert vendedor == {"Razón Social": "ACME S.A.S.", "NIT": "900123456"}
+
+    def test_comprador(self):
+        _, comprador = _parse_invoice_header(self.SAMPLE)
+        assert comprador == {"Razón Social": "CLIENTE LTDA", "NIT": "800987654"}
+
+    def test_keeps_first_occurrence(self):
+        text = self.SAMPLE + "Número Documento: 111\n"
+        _, comprador = _parse_invoice_header(text)
+        assert comprador["NIT"] == "800987654"
+
+    def test_missing_nit_leaves_party_empty(self):
+        text = "Razón Social: ACME S.A.S.\n"
+        vendedor, comprador = _parse_invoice_header(text)
+        assert vendedor == {}
+        assert comprador == {}
+
+
+# ── Bancolombia / Davivienda / Colpatria text parsers ────────────────────────
+
+class TestParseBancolombiaText:
+    SAMPLE = (
+        "EXTRACTO CUENTA DE AHORROS\n"
+        "1/04 PAGO QR ERIS DAYID B. -24,300.00 3,888,729.61\n"
+        "  1/04 ABONO INTERESES AHORROS .86 4,751,911.77  \n"
+        "FIN DEL ESTADO DE CUENTA\n"
+    )
+
+    def test_row_count(self):
+        df = _parse_bancolombia_text(self.SAMPLE)
+        assert len(df) == 2
+
+    def test_negative_value_is_salida(self):
+        import pandas as pd
+        row = _parse_bancolombia_text(self.SAMPLE).iloc[0]
+        assert row["Salidas"] == 24300
+        assert pd.isna(row["Entradas"])
+        assert row["Descripción"] == "PAGO QR ERIS DAYID B."
+
+    def test_indented_line_matches(self):
+        row = _parse_bancolombia_text(self.SAMPLE).iloc[1]
+        assert row["Entradas"] == pytest.approx(0.86)
+        assert row["Saldo"] == pytest.approx(4751911.77)
+
+    def test_does_not_join_lines(self):
+        assert _parse_bancolombia_text("1/04 PAGO QR\n24,300.00 3,888,729.61\n") is None
+
+    def test_long_blank_run_after_date_fails_fast(self):
+        # The separator after FECHA used to give the blanks back one at a time
+        assert _parse_bancolombia_text("1/04" + " " * 20_000 + "x\n") is None
+
+    def test_blank_description_still_matches(self):
+        row = _parse_bancolombia_text("1/04   24,300.00 3,888,729.61\n").iloc[0]
+        assert row["Descripción"] == "" and row["Entradas"] == 24300
+
+    def test_long_malformed_line_is_rejected(self):
+        # Many amount-like tokens but no trailing VALOR SALDO pair
+        line = "1/04 " + " 1.1" * 5000 + " x"
+        assert _parse_bancolombia_text(line) is None
+
+
+class TestParseDaviviendaText:
+    SAMPLE = (
+        "01 01 9070 Abono ventas netas Mastercard $ 0.00 $ 5,534,339.00\n"
+        "17015595\n"
+        "02 01 0033 Pago ENEL PAGO FACTURA $ 1,452,470.00 $ 0.00\n"
+        "Saldo Anterior $ 1.00\n"
+    )
+
+    def test_row_count(self):
+        df = _parse_davivienda_text(self.SAMPLE)
+        assert len(df) == 2
+
+    def test_long_blank_run_fails_fast(self):
+        # Quadratic backtracking over the blanks took seconds before.
+        line = "01 01 9070 Abono" + " " * 50_000 + "$ 0.00\n"
+        assert _parse_davivienda_text(line + self.SAMPLE) is not None
+
+    def test_long_blank_run_after_office_fails_fast(self):
+        line = "01 01 9070" + " " * 20_000 + "Abono $ 0.00\n"
+        assert len(_parse_davivienda_text(line + self.SAMPLE)) == 2
+
+    def test_credito_is_entrada_with_continuation(self):
+        row = _parse_davivienda_text(self.SAMPLE).iloc[0]
+        assert row["Entradas"] == 5534339
+        assert row["Descripción"] == "Abono ventas netas Mastercard 17015595"
+        assert row["Fecha"] == "01/01"
+
+    def test_skips_footer_continuation(self):
+        row = _parse_davivienda_text(self.SAMPLE).iloc[1]
+        assert row["Salidas"] == 1452470
+        assert row["Descripción"] == "Pago ENEL PAGO FACTURA"
+
+
+class TestParseColpatriaText:
+    SAMPLE = (
+        "2/02/2026 CENTRAL DE C RBAN/D.ELE/ ABONO 1.040.000,00 2.464.947,31\n"
+        "NE:0015353485-NCN:000001\n"
+        "6/02/2026 CENTRAL DE C PAGO-PSE-259595580 -9.900.000,00 1.492.707,31\n"
+    )
+
+    def test_rows_and_signs(self):
+        df = _parse_colpatria_text(self.SAMPLE)
+        assert len(df) == 2
+        assert df.iloc[0]["Entradas"] == 1040000
+        assert df.iloc[1]["Salidas"] == 9900000
+        assert df.iloc[1]["Saldo"] == pytest.approx(1492707.31)
+
+    def test_continuation_appended(self):
+        df = _parse_colpatria_text(self.SAMPLE)
+        assert df.iloc[0]["Descripción"] == "CENTRAL DE C RBAN/D.ELE/ ABONO NE:0015353485-NCN:000001"
+        assert df.iloc[1]["Descripción"] == "CENTRAL DE C PAGO-PSE-259595580"
+
+
+class TestParseTextTransactions:
+    BANCO_LINE = "1/04 PAGO QR ERIS DAYID B. -24,300.00 3,888,729.61\n"
+    DAVI_LINE = "01 01 9070 Abono ventas netas $ 0.00 $ 5,534,339.00\n"
+
+    def test_header_selects_bancolombia(self):
+        df = _parse_text_transactions("BANCOLOMBIA S.A.\n" + self.BANCO_LINE + self.DAVI_LINE * 3)
+        assert len(df) == 1 and df.iloc[0]["Salidas"] == 24300
+
+    def test_header_selects_davivienda(self):
+        df = _parse_text_transactions("Banco Davivienda\n" + self.DAVI_LINE + self.BANCO_LINE * 3)
+        assert len(df) == 1 and df.iloc[0]["Entradas"] == 5534339
+
+    def test_no_header_keeps_parser_with_most_rows(self):
+        df = _parse_text_transactions(self.DAVI_LINE + self.BANCO_LINE * 3)
+        assert len(df) == 3
+
+    def test_named_parser_without_rows_falls_back(self):
+        df = _parse_text_transactions("BANCOLOMBIA\n" + self.DAVI_LINE)
+        assert len(df) == 1 and df.iloc[0]["Entradas"] == 5534339
+
+    def test_no_header_single_pass_keeps_davivienda_continuation(self):
+        df = _parse_text_transactions(self.DAVI_LINE * 2 + "Referencia 123\n" + self.BANCO_LINE)
+        assert len(df) == 2
+        assert df.iloc[1]["Descripción"].endswith("Referencia 123")
+
+    def test_long_leading_blank_runs_fail_fast_in_every_parser(self):
+        text = "".join(prefix + " " * 20_000 + "x\n" for prefix in (
+            "1/04", "01 01 9070", "12345 01-01-2026 01-01-2026", "01/02/2024"))
+        assert len(_parse_text_transactions(text + self.BANCO_LINE)) == 1
+
 
 # ── BBVA regex pattern ────────────────────────────────────────────────────────
 
@@ -159,6 +501,51 @@ class TestParseBBVAText:
         assert df.iloc[0]["Entradas"] is not None
 
 
+# ── Generic table processing ──────────────────────────────────────────────────
+
+class TestProcessTableData:
+    def test_debit_credit_columns(self):
+        import pandas as pd
+        headers = ["Fecha", "Descripción", "Débito", "Crédito"]
+        rows = [
+            ["01/03", "Pago", "$ 1.225.000", None],
+            ["02/03", "Abono", "", "336.050,42"],
+        ]
+        df = _process_table_data(headers, rows)
+        assert df.iloc[0]["Salidas"] == 1225000
+        assert pd.isna(df.iloc[0]["Entradas"])
+        assert df.iloc[1]["Entradas"] == pytest.approx(336050.42)
+        assert pd.isna(df.iloc[1]["Salidas"])
+
+    def test_single_amount_column_split_by_sign(self):
+        import pandas as pd
+        headers = ["Descripción", "Valor"]
+        rows = [
+            ["Pago", "-$ 3,000.00"],
+            ["Abono", "$ 1,500.00"],
+            ["Nota", ""],
+        ]
+        df = _process_table_data(headers, rows)
+        assert df.iloc[0]["Salidas"] == 3000
+        assert pd.isna(df.iloc[0]["Entradas"])
+        assert df.iloc[1]["Entradas"] == 1500
+        assert pd.isna(df.iloc[1]["Salidas"])
+        assert pd.isna(df.iloc[2]["Entradas"]) and pd.isna(df.iloc[2]["Salidas"])
+        assert "_amount" not in df.columns
+
+    def test_parentheses_mark_negative(self):
+        import pandas as pd
+        df = _process_table_data(["Descripción", "Valor"], [["Cargo", "(1.225.000)"], ["Abono", "336.050,42"]])
+        assert df.iloc[0]["Salidas"] == 1225000
+        assert pd.isna(df.iloc[0]["Entradas"])
+        assert df.iloc[1]["Entradas"] == pytest.approx(336050.42)
+
+    def test_no_monetary_column_adds_nothing(self):
+        df = _process_table_data(["Descripción", "Nota"], [["Pago", "x"], ["Abono", "y"]])
+        assert "Entradas" not in df.columns
+        assert "Salidas" not in df.columns
+
+
 # ── Adquirencia table detection ───────────────────────────────────────────────
 
 class TestIsAdquirenciaTable:
@@ -252,6 +639,60 @@ class TestParseAdquirenciaTables:
         assert result is None
 
 
+# ── Planilla PILA page rows ───────────────────────────────────────────────────
+
+class _StubTable:
+    def __init__(self, rows):
+        self._rows = rows
+        self.cells = [(x, 0, x + 1, 1) for x in range(len(rows[0]))]
+
+    def extract(self):
+        return self._rows
+
+
+class _StubPage:
+    def __init__(self, tables):
+        self._tables = tables
+
+    def find_tables(self):
+        return [_StubTable(t) for t in self._tables]
+
+
+class TestPlanillaPageRows:
+    @staticmethod
+    def _row43(no):
+        row = [None] * 43
+        row[:4] = [no, "CC", "1234567", "PEREZ\nJUAN"]
+        row[21], row[22], row[23] = "230301\n1", "30", "1.300.000"
+        row[36] = "0,522%"
+        return row
+
+    def test_keeps_only_employee_rows(self):
+        header = ["No."] + [None] * 42
+        table = [header, self._row43(" 1 "), [None] * 43, ["TOTAL"] + [None] * 42, self._row43("2")]
+        rows = _planilla_page_rows(_StubPage([table]))
+        assert [r[0] for r in rows] == ["1", "2"]
+
+    def test_field_conversions(self):
+        rec = dict(zip(_PLANILLA_FIELDS, _planilla_page_rows(_StubPage([[self._row43("1")]]))[0]))
+        assert rec["Nombre"] == "PEREZ JUAN"
+        assert rec["Pension_Codigo"] == "230301"
+        assert rec["Pension_Dias"] == 30
+        assert rec["Pension_IBC"] == "1.300.000"  # cleaned per column later
+        assert rec["Riesgo_Tarifa"] == "0,522"  # not a float literal, kept as text
+        assert rec["Salud_EPS"] is None
+
+    def test_skips_unknown_layouts(self):
+        assert _planilla_page_rows(_StubPage([[["1"] * 10]])) == []
+
+    def test_unknown_layouts_are_not_extracted(self):
+        table = _StubTable([["1"] * 10])
+        table.extract = None  # raises if called
+        page = _StubPage([])
+        page.find_tables = lambda: [table]
+        assert _planilla_page_rows(page) == []
+
+
 # ── Integration: BBVA PDF ─────────────────────────────────────────────────────
 
 class TestBBVAIntegration: